@@ -4,6 +4,9 @@ import sqlite3
 import os
 import sys
 import csv
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice, repeat
 from pathlib import Path
 
 # Configuration
@@ -13,50 +16,113 @@ DATA_BASE = f"{BASE_DIR}/input/plaintext"
 DATASETS = ["data_0_001", "data_0_01", "data_0_1"]
 QUERIES = ["tpch_tb1", "tpch_tb2", "tpch_tm1", "tpch_tm2", "tpch_tm3"]
 
+# Number of leading data rows sampled to pick each column's type
+TYPE_SAMPLE_ROWS = 1000
+
+def sniff_column_type(values):
+    """Pick a SQLite column type from sample CSV values, ignoring empty cells"""
+    values = [v for v in values if v.strip()]
+    if not values:
+        return 'TEXT'
+    try:
+        for v in values:
+            int(v)
+        return 'INTEGER'
+    except ValueError:
+        pass
+    try:
+        for v in values:
+            float(v)
+        return 'REAL'
+    except ValueError:
+        return 'TEXT'
+
 def load_csv_to_sqlite(conn, csv_path, table_name):
     """Load a CSV file into SQLite table"""
     with open(csv_path, 'r') as f:
         reader = csv.reader(f)
         headers = next(reader)
+        sample = list(islice(reader, TYPE_SAMPLE_ROWS))
         
-        # Create table with all columns as TEXT
-        cols = ', '.join([f'"{h}" TEXT' for h in headers])
+        # Create table with column types taken from a sample of data rows, so
+        # numeric predicates compare numerically rather than as strings; a
+        # column is numeric when all its non-empty sampled cells are
+        types = [sniff_column_type([row[i] for row in sample if i < len(row)])
+                 for i in range(len(headers))]
+        cols = ', '.join([f'"{h}" {t}' for h, t in zip(headers, types)])
         conn.execute(f'DROP TABLE IF EXISTS {table_name}')
         conn.execute(f'CREATE TABLE {table_name} ({cols})')
         
-        # Insert data
+        if not sample:
+            return
+        
+        # Insert data (one executemany over the reader instead of per-row execute)
         placeholders = ', '.join(['?' for _ in headers])
-        for row in reader:
-            conn.execute(f'INSERT INTO {table_name} VALUES ({placeholders})', row)
-    conn.commit()
+        conn.executemany(f'INSERT INTO {table_name} VALUES ({placeholders})',
+                         chain(sample, reader))
 
 def convert_to_count_query(query):
     """Convert SELECT * to SELECT COUNT(*)"""
     # Simple replacement for our TPC-H queries
     return query.replace("SELECT *", "SELECT COUNT(*)")
 
-def get_row_count(dataset, query_file):
-    """Get row count for a query on a dataset"""
+def load_count_query(query_file):
+    """Read a query file and return its COUNT(*) rewrite"""
+    with open(query_file, 'r') as f:
+        return convert_to_count_query(f.read())
+
+def referenced_tables(query, table_names):
+    """Return the dataset tables that a query mentions by name"""
+    return [t for t in table_names
+            if re.search(rf'\b{re.escape(t)}\b', query, re.IGNORECASE)]
+
+# In-memory databases, one per dataset, reused across queries.
+# Maps dataset -> (connection, set of tables already ingested)
+_DATASET_DBS = {}
+
+def open_dataset_db(dataset, query):
+    """Return the in-memory SQLite database for a dataset, ingesting only
+    the tables the query needs that have not been loaded yet"""
+    if dataset not in _DATASET_DBS:
+        conn = sqlite3.connect(':memory:')
+        # Throwaway database: no journaling or fsync needed during ingest
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-262144')  # 256 MiB page cache
+        _DATASET_DBS[dataset] = (conn, set())
+    conn, loaded = _DATASET_DBS[dataset]
+    
     data_path = f"{DATA_BASE}/{dataset}"
+    csv_files = {f.stem: f for f in Path(data_path).glob('*.csv')}
+    missing = [t for t in referenced_tables(query, csv_files) if t not in loaded]
     
-    if not os.path.exists(data_path):
-        return None
+    # Load the missing CSV files inside a single transaction
+    with conn:
+        for table_name in missing:
+            load_csv_to_sqlite(conn, csv_files[table_name], table_name)
+    loaded.update(missing)
     
-    # Read query
-    with open(query_file, 'r') as f:
-        original_query = f.read()
+    return conn
+
+def close_dataset_dbs():
+    """Close all cached dataset databases"""
+    for conn, _ in _DATASET_DBS.values():
+        conn.close()
+    _DATASET_DBS.clear()
+
+def get_row_count(dataset, query_file, count_query):
+    """Get row count for a query on a dataset
     
-    # Convert to COUNT query
-    count_query = convert_to_count_query(original_query)
+    count_query is the COUNT(*) rewrite of query_file, prepared once by main().
+    """
+    data_path = f"{DATA_BASE}/{dataset}"
     
-    # Create temporary database
-    conn = sqlite3.connect(':memory:')
+    if not os.path.exists(data_path):
+        return None
     
     try:
-        # Load all CSV files in dataset
-        for csv_file in Path(data_path).glob('*.csv'):
-            table_name = csv_file.stem
-            load_csv_to_sqlite(conn, csv_file, table_name)
+        conn = open_dataset_db(dataset, count_query)
         
         # Execute count query
         cursor = conn.execute(count_query)
@@ -65,8 +131,15 @@ def get_row_count(dataset, query_file):
     except Exception as e:
         print(f"Error for {dataset}/{os.path.basename(query_file)}: {e}", file=sys.stderr)
         return None
+
+def count_dataset(dataset, queries):
+    """Count every (query_file, count_query) on one dataset (runs in its own
+    worker process)"""
+    try:
+        return [get_row_count(dataset, query_file, count_query)
+                for query_file, count_query in queries]
     finally:
-        conn.close()
+        close_dataset_dbs()
 
 def main():
     # Open output file
@@ -103,11 +176,21 @@ def main():
     # Store counts for growth factor calculation
     counts = {}
     
-    # Process each query
+    # Datasets are independent, so count each one in its own process; the
+    # queries of one dataset share that worker's in-memory database
+    available = [q for q in QUERIES if os.path.exists(f"{QUERY_DIR}/{q}.sql")]
+    query_files = [f"{QUERY_DIR}/{q}.sql" for q in available]
+    # Read and rewrite each query once here; workers receive the SQL text
+    queries = [(query_file, load_count_query(query_file)) for query_file in query_files]
+    with ProcessPoolExecutor(max_workers=len(DATASETS)) as executor:
+        results = executor.map(count_dataset, DATASETS, repeat(queries))
+        for dataset, dataset_counts in zip(DATASETS, results):
+            for query, count in zip(available, dataset_counts):
+                counts[f"{query}_{dataset}"] = count
+    
+    # Print each query
     for query in QUERIES:
-        query_file = f"{QUERY_DIR}/{query}.sql"
-        
-        if not os.path.exists(query_file):
+        if query not in available:
             row = f"{query:<12}"
             for dataset in DATASETS:
                 row += f"{'N/A':<15}"
@@ -117,8 +200,7 @@ def main():
         row = f"{query:<12}"
         
         for dataset in DATASETS:
-            count = get_row_count(dataset, query_file)
-            counts[f"{query}_{dataset}"] = count
+            count = counts[f"{query}_{dataset}"]
             
             if count is not None:
                 row += f"{count:<15,}"
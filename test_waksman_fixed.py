@@ -4,29 +4,74 @@ Fixed Python implementation of Waksman shuffle with clear semantics
 n = size of my group (number of elements I'm shuffling)
 """
 
-import random
-from typing import List
-
-class WaksmanShuffleFixed:
-    def __init__(self, seed=42):
-        """Initialize with deterministic RNG for testing"""
-        self.rng = random.Random(seed)
-        self.switch_history = []
-        
-    def get_switch_bit(self, level: int, position: int) -> int:
-        """Get deterministic switch bit based on level and position"""
-        hash_val = (level * 1000 + position) % 100
-        return 1 if hash_val < 50 else 0
-    
-    def swap_elements(self, array: List, idx1: int, idx2: int, swap: int):
-        """Swap elements if swap=1"""
-        if swap:
-            array[idx1], array[idx2] = array[idx2], array[idx1]
-            
-    def waksman_recursive(self, array: List, start: int, stride: int, n: int, 
-                          level: int, depth: int = 0) -> None:
+import math
+from typing import List, Tuple
+
+import numpy as np
+
+from waksman_common import (PHASE_BOTTOM, PHASE_INPUT, PHASE_OUTPUT, SWITCH_BASE,
+                            SWITCH_INPUT, SWITCH_OUTPUT, WaksmanShuffleBase)
+
+class WaksmanShuffleFixed(WaksmanShuffleBase):
+    def build_switch_layers(self, n: int) -> Tuple[List, List]:
+        """
+        Flatten the recursive network into per-level switch layers
+
+        All switches of one level act on disjoint index pairs (my group and my
+        sibling groups never overlap), so a layer can be applied with one
+        vectorized gather/scatter. Input layers run in increasing level order
+        and output layers in decreasing level order, which keeps the recursive
+        ordering of any two switches that share an index.
+        Returns (input_layers, output_layers) as lists of (idx1, idx2, swap).
+        """
+        inputs = {}   # level -> list of (idx1, idx2, swap) blocks
+        outputs = {}
+
+        def add_block(layers, idx1, idx2, swap, level):
+            # Same bounds check as the recursive version, in the same order
+            if len(idx2) and idx2.max() >= n:
+                bad = int(idx2[np.argmax(idx2 >= n)])
+                raise IndexError(f"Index {bad} out of bounds")
+            layers.setdefault(level, []).append((idx1, idx2, swap))
+
+        def visit(start, stride, size, level):
+            if size <= 1:
+                return
+            if size == 2:
+                idx1 = np.array([start])
+                add_block(inputs, idx1, idx1 + stride,
+                          self.get_switch_bits(level, idx1), level)
+                return
+
+            # INPUT SWITCHES: one per pair in my group
+            num_pairs = size // 2
+            idx1 = start + 2 * np.arange(num_pairs) * stride
+            add_block(inputs, idx1, idx1 + stride,
+                      self.get_switch_bits(level, idx1), level)
+
+            # Top network takes the unpaired element when my group is odd
+            top_size = num_pairs + size % 2
+            visit(start, stride * 2, top_size, level + 1)
+            visit(start + stride, stride * 2, num_pairs, level + 1)
+
+            # OUTPUT SWITCHES: pairs 1..num_pairs-1
+            idx1 = start + 2 * np.arange(1, num_pairs) * stride
+            add_block(outputs, idx1, idx1 + stride,
+                      self.get_switch_bits(level + 10000, idx1), level)
+
+        visit(0, 1, n, 0)
+
+        def merge(layers, levels):
+            return [tuple(np.concatenate(col) for col in zip(*layers[lv]))
+                    for lv in levels]
+
+        return (merge(inputs, sorted(inputs)),
+                merge(outputs, sorted(outputs, reverse=True)))
+
+    def waksman_iterative(self, array: List, start: int, stride: int, n: int,
+                          level: int) -> None:
         """
-        Recursive Waksman shuffle
+        Waksman shuffle driven by an explicit stack instead of recursion
         
         Parameters:
         - array: The full array being shuffled
@@ -34,122 +79,156 @@ class WaksmanShuffleFixed:
         - stride: Distance between consecutive elements in my group
         - n: SIZE OF MY GROUP (number of elements I'm responsible for)
         - level: Recursion level for RNG
-        - depth: Debug depth for printing
+        
+        Each stack frame is (phase, start, stride, n, level, depth). A group is
+        visited in three phases: PHASE_INPUT applies its input switches and
+        descends into the top network, PHASE_BOTTOM descends into the bottom
+        network once the top one is done, and PHASE_OUTPUT applies its output
+        switches. Switches and trace lines come out in the recursive order.
         """
-        indent = "  " * depth
-        print(f"{indent}waksman_recursive: start={start}, stride={stride}, n={n} (my group size), level={level}")
+        debug = self.debug
+        # Subnetworks halve n, so levels run from level to
+        # level + ceil(log2(n)) inclusive
+        num_levels = level + math.ceil(math.log2(max(n, 2))) + 1
+        input_bits, output_bits = self.switch_lut(len(array), num_levels)
+        stack = [(PHASE_INPUT, start, stride, n, level, 0)]
         
-        # Base cases
-        if n <= 1:
-            print(f"{indent}  Base case: n<=1, nothing to do")
-            return
-            
-        if n == 2:
-            # Single switch between my two elements
-            idx1 = start
-            idx2 = start + stride
-            swap = self.get_switch_bit(level, start)
+        while stack:
+            phase, start, stride, n, level, depth = stack.pop()
             
-            print(f"{indent}  Base case n=2: swap={swap} at positions {idx1},{idx2}")
+            if phase == PHASE_BOTTOM:
+                # Bottom subnetwork: elements at positions 1, 3, 5, ... in my group
+                bottom_size = n // 2
+                if debug:
+                    indent = "  " * depth
+                    print(f"{indent}  Calling BOTTOM: start={start + stride}, stride={stride * 2}, n={bottom_size}")
+                stack.append((PHASE_INPUT, start + stride, stride * 2, bottom_size, level + 1, depth + 1))
+                continue
             
-            # Bounds check
-            if idx2 >= len(array):
-                print(f"{indent}  ERROR: idx2={idx2} >= len(array)={len(array)}")
-                raise IndexError(f"Index {idx2} out of bounds")
+            if phase == PHASE_OUTPUT:
+                # OUTPUT SWITCHES: One less than input switches (Waksman property)
+                # The first pair doesn't have an output switch
+                num_pairs = n // 2
+                num_output_switches = max(0, num_pairs - 1)
+                if debug:
+                    indent = "  " * depth
+                    print(f"{indent}  OUTPUT SWITCHES: {num_output_switches} switches")
                 
-            self.swap_elements(array, idx1, idx2, swap)
-            self.switch_history.append((idx1, idx2, swap, f"n=2 base"))
-            return
+                for i in range(1, num_pairs):  # Start from pair 1, not pair 0
+                    # The i-th pair in my group (after both subnetworks)
+                    idx1 = start + (i * 2) * stride
+                    idx2 = start + (i * 2 + 1) * stride
+                    
+                    # Bounds check
+                    if idx2 >= len(array):
+                        if debug:
+                            print(f"{'  ' * depth}    ERROR: idx2={idx2} >= len(array)={len(array)}")
+                        raise IndexError(f"Index {idx2} out of bounds")
+                        
+                    swap = output_bits[level][idx1]
+                    if debug:
+                        print(f"{indent}    Output switch {i-1}: swap={swap} at positions {idx1},{idx2}")
+                    self.swap_elements(array, idx1, idx2, swap)
+                    self._record_switch(idx1, idx2, swap, SWITCH_OUTPUT, i - 1)
+                continue
             
-        # For n > 2: Waksman recursive structure
-        # Key insight: We have n elements in our group
-        # They form n/2 pairs (with possibly 1 unpaired element if n is odd)
-        
-        num_pairs = n // 2  # Number of pairs in my group
-        print(f"{indent}  Recursive case: n={n} elements form {num_pairs} pairs")
-        
-        # INPUT SWITCHES: One switch per pair
-        print(f"{indent}  INPUT SWITCHES: {num_pairs} switches")
-        for i in range(num_pairs):
-            # The i-th pair in my group
-            idx1 = start + (i * 2) * stride      # Element 2*i of my group
-            idx2 = start + (i * 2 + 1) * stride  # Element 2*i+1 of my group
+            if debug:
+                indent = "  " * depth
+                print(f"{indent}waksman_iterative: start={start}, stride={stride}, n={n} (my group size), level={level}")
             
-            # Bounds check
-            if idx2 >= len(array):
-                print(f"{indent}    ERROR: idx2={idx2} >= len(array)={len(array)}")
-                raise IndexError(f"Index {idx2} out of bounds")
+            # Base cases
+            if n <= 1:
+                if debug:
+                    print(f"{indent}  Base case: n<=1, nothing to do")
+                continue
                 
-            swap = self.get_switch_bit(level, idx1)
-            print(f"{indent}    Input switch {i}: swap={swap} at positions {idx1},{idx2}")
-            self.swap_elements(array, idx1, idx2, swap)
-            self.switch_history.append((idx1, idx2, swap, f"input {i}"))
-            
-        # RECURSIVE CALLS
-        # After input switches, elements are at:
-        # - Even positions (0, 2, 4, ...): These go to top network
-        # - Odd positions (1, 3, 5, ...): These go to bottom network
-        # If n is odd, the last element (at position n-1) goes to top network
-        
-        if n % 2 == 0:
-            # Even n: both networks have n/2 elements
-            top_size = num_pairs
-            bottom_size = num_pairs
-        else:
-            # Odd n: top network has one more element (the unpaired one)
-            top_size = num_pairs + 1  # Includes the unpaired element
-            bottom_size = num_pairs
-            
-        print(f"{indent}  RECURSIVE CALLS: top_size={top_size}, bottom_size={bottom_size}")
-        
-        # Top subnetwork: elements at positions 0, 2, 4, ... in my group
-        print(f"{indent}  Calling TOP: start={start}, stride={stride * 2}, n={top_size}")
-        self.waksman_recursive(array, start, stride * 2, top_size, level + 1, depth + 1)
-        
-        # Bottom subnetwork: elements at positions 1, 3, 5, ... in my group  
-        print(f"{indent}  Calling BOTTOM: start={start + stride}, stride={stride * 2}, n={bottom_size}")
-        self.waksman_recursive(array, start + stride, stride * 2, bottom_size, level + 1, depth + 1)
+            if n == 2:
+                # Single switch between my two elements
+                idx1 = start
+                idx2 = start + stride
+                swap = input_bits[level][start]
+                
+                if debug:
+                    print(f"{indent}  Base case n=2: swap={swap} at positions {idx1},{idx2}")
+                
+                # Bounds check
+                if idx2 >= len(array):
+                    if debug:
+                        print(f"{'  ' * depth}  ERROR: idx2={idx2} >= len(array)={len(array)}")
+                    raise IndexError(f"Index {idx2} out of bounds")
+                    
+                self.swap_elements(array, idx1, idx2, swap)
+                self._record_switch(idx1, idx2, swap, SWITCH_BASE, 0)
+                continue
+                
+            # For n > 2: Waksman recursive structure
+            # Key insight: We have n elements in our group
+            # They form n/2 pairs (with possibly 1 unpaired element if n is odd)
             
-        # OUTPUT SWITCHES: One less than input switches (Waksman property)
-        # The first pair doesn't have an output switch
-        num_output_switches = max(0, num_pairs - 1)
-        print(f"{indent}  OUTPUT SWITCHES: {num_output_switches} switches")
-        
-        for i in range(1, num_pairs):  # Start from pair 1, not pair 0
-            # The i-th pair in my group (after recursive calls)
-            idx1 = start + (i * 2) * stride
-            idx2 = start + (i * 2 + 1) * stride
+            num_pairs = n // 2  # Number of pairs in my group
+            if debug:
+                print(f"{indent}  Recursive case: n={n} elements form {num_pairs} pairs")
             
-            # Bounds check
-            if idx2 >= len(array):
-                print(f"{indent}    ERROR: idx2={idx2} >= len(array)={len(array)}")
-                raise IndexError(f"Index {idx2} out of bounds")
+            # INPUT SWITCHES: One switch per pair
+            if debug:
+                print(f"{indent}  INPUT SWITCHES: {num_pairs} switches")
+            for i in range(num_pairs):
+                # The i-th pair in my group
+                idx1 = start + (i * 2) * stride      # Element 2*i of my group
+                idx2 = start + (i * 2 + 1) * stride  # Element 2*i+1 of my group
                 
-            swap = self.get_switch_bit(level + 10000, idx1)
-            print(f"{indent}    Output switch {i-1}: swap={swap} at positions {idx1},{idx2}")
-            self.swap_elements(array, idx1, idx2, swap)
-            self.switch_history.append((idx1, idx2, swap, f"output {i-1}"))
+                # Bounds check
+                if idx2 >= len(array):
+                    if debug:
+                        print(f"{'  ' * depth}    ERROR: idx2={idx2} >= len(array)={len(array)}")
+                    raise IndexError(f"Index {idx2} out of bounds")
+                    
+                swap = input_bits[level][idx1]
+                if debug:
+                    print(f"{indent}    Input switch {i}: swap={swap} at positions {idx1},{idx2}")
+                self.swap_elements(array, idx1, idx2, swap)
+                self._record_switch(idx1, idx2, swap, SWITCH_INPUT, i)
+                
+            # SUBNETWORKS
+            # After input switches, elements are at:
+            # - Even positions (0, 2, 4, ...): These go to top network
+            # - Odd positions (1, 3, 5, ...): These go to bottom network
+            # If n is odd, the last element (at position n-1) goes to top network
+            # (Odd n: top network has one more element, the unpaired one)
+            top_size = num_pairs + n % 2
+            bottom_size = num_pairs
+                
+            if debug:
+                print(f"{indent}  RECURSIVE CALLS: top_size={top_size}, bottom_size={bottom_size}")
+                print(f"{indent}  Calling TOP: start={start}, stride={stride * 2}, n={top_size}")
+            
+            # Top subnetwork runs first, then the bottom one, then my outputs
+            stack.append((PHASE_OUTPUT, start, stride, n, level, depth))
+            stack.append((PHASE_BOTTOM, start, stride, n, level, depth))
+            stack.append((PHASE_INPUT, start, stride * 2, top_size, level + 1, depth + 1))
             
     def shuffle(self, array: List) -> List:
         """Main entry point for Waksman shuffle"""
         n = len(array)
-        print(f"\n=== Starting Waksman shuffle for array of size {n} ===")
-        print(f"Initial array: {array}")
+        if self.debug:
+            print(f"\n=== Starting Waksman shuffle for array of size {n} ===")
+            print(f"Initial array: {array}")
         
-        self.switch_history = []
+        self._reset_history(n)
         result = array.copy()
         
         # Start with the full array as our group
-        self.waksman_recursive(result, 0, 1, n, 0)
+        self.waksman_iterative(result, 0, 1, n, 0)
         
-        print(f"Final array: {result}")
-        print(f"Total switches: {len(self.switch_history)}")
+        if self.debug:
+            print(f"Final array: {result}")
+            print(f"Total switches: {self._hist_count}")
         return result
 
 
 def test_fixed_waksman():
     """Test the fixed Waksman implementation"""
-    shuffler = WaksmanShuffleFixed()
+    shuffler = WaksmanShuffleFixed(debug=True)
     
     # Test the problematic sizes
     test_sizes = [2, 3, 4, 5, 7]
@@ -169,6 +248,12 @@ def test_fixed_waksman():
                 print(f"✓ Valid permutation for n={n}")
             else:
                 print(f"✗ INVALID result for n={n}: {result}")
+            
+            # Cross-check the layered vectorized implementation
+            if shuffler.shuffle_vectorized(array) == result:
+                print(f"✓ Vectorized shuffle matches for n={n}")
+            else:
+                print(f"✗ Vectorized shuffle MISMATCH for n={n}")
                 
             # Check bounds
             max_idx = max(max(idx1, idx2) for idx1, idx2, _, _ in shuffler.switch_history)
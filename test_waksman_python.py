@@ -4,138 +4,225 @@ Python implementation of the in-memory Waksman shuffle
 Matches the C implementation to help debug the n=3 issue
 """
 
-import random
+import math
 from typing import List, Tuple
 
-class WaksmanShuffle:
-    def __init__(self, seed=42):
-        """Initialize with deterministic RNG for testing"""
-        self.rng = random.Random(seed)
-        self.switch_history = []
-        
-    def get_switch_bit(self, level: int, position: int) -> int:
-        """Get deterministic switch bit based on level and position"""
-        # Use a simple hash for deterministic switches
-        hash_val = (level * 1000 + position) % 100
-        return 1 if hash_val < 50 else 0
-    
-    def swap_elements(self, array: List, idx1: int, idx2: int, swap: int):
-        """Swap elements if swap=1"""
-        if swap:
-            array[idx1], array[idx2] = array[idx2], array[idx1]
-            
-    def waksman_recursive(self, array: List, start: int, stride: int, n: int, 
-                          level: int, depth: int = 0) -> None:
+import numpy as np
+
+from waksman_common import (PHASE_BOTTOM, PHASE_INPUT, PHASE_OUTPUT, SWITCH_BASE,
+                            SWITCH_INPUT, SWITCH_OUTPUT, WaksmanShuffleBase)
+
+class WaksmanShuffle(WaksmanShuffleBase):
+    def build_switch_layers(self, n: int) -> Tuple[List, List]:
+        """
+        Flatten the recursive network into per-level switch layers
+
+        All switches of one level act on disjoint index pairs, so a layer can
+        be applied with one vectorized gather/scatter. Running the input layers
+        in increasing level order and the output layers in decreasing level
+        order keeps the recursive ordering of any two switches sharing an index.
+        Returns (input_layers, output_layers) as lists of (idx1, idx2, swap).
+        """
+        inputs = {}   # level -> list of (idx1, idx2, swap) blocks
+        outputs = {}
+
+        def add_block(layers, idx1, idx2, swap, level):
+            # Same bounds check as the recursive version, in the same order
+            if len(idx2) and idx2.max() >= n:
+                bad = int(idx2[np.argmax(idx2 >= n)])
+                raise IndexError(f"Index {bad} out of bounds for array of size {n}")
+            layers.setdefault(level, []).append((idx1, idx2, swap))
+
+        def visit(start, stride, size, level):
+            if size <= 1:
+                return
+            if size == 2:
+                idx1 = np.array([start])
+                add_block(inputs, idx1, idx1 + stride,
+                          self.get_switch_bits(level, idx1), level)
+                return
+
+            half = size // 2
+            idx1 = start + 2 * np.arange(half) * stride
+            add_block(inputs, idx1, idx1 + stride,
+                      self.get_switch_bits(level, idx1), level)
+
+            if size % 2 == 1:
+                half = (size + 1) // 2
+            visit(start, stride * 2, half, level + 1)
+            if size % 2 == 0:
+                visit(start + stride, stride * 2, half, level + 1)
+            else:
+                visit(start + stride, stride * 2, half - 1, level + 1)
+
+            idx1 = start + 2 * np.arange(1, half) * stride
+            add_block(outputs, idx1, idx1 + stride,
+                      self.get_switch_bits(level + 10000, idx1), level)
+
+        visit(0, 1, n, 0)
+
+        def merge(layers, levels):
+            return [tuple(np.concatenate(col) for col in zip(*layers[lv]))
+                    for lv in levels]
+
+        return (merge(inputs, sorted(inputs)),
+                merge(outputs, sorted(outputs, reverse=True)))
+
+    def waksman_iterative(self, array: List, start: int, stride: int, n: int,
+                          level: int) -> None:
         """
-        Recursive Waksman shuffle implementation
+        Waksman shuffle driven by an explicit stack instead of recursion
         Matches the C implementation structure
+        
+        Each stack frame is (phase, start, stride, n, level, depth). A group is
+        visited in three phases: PHASE_INPUT applies its input switches and
+        descends into the top network, PHASE_BOTTOM descends into the bottom
+        network once the top one is done, and PHASE_OUTPUT applies its output
+        switches. Switches and trace lines come out in the recursive order.
         """
-        indent = "  " * depth
-        print(f"{indent}waksman_recursive: start={start}, stride={stride}, n={n}, level={level}")
+        debug = self.debug
+        # Subnetworks halve n, so levels run from level to
+        # level + ceil(log2(n)) inclusive
+        num_levels = level + math.ceil(math.log2(max(n, 2))) + 1
+        input_bits, output_bits = self.switch_lut(len(array), num_levels)
+        stack = [(PHASE_INPUT, start, stride, n, level, 0)]
         
-        # Base cases
-        if n <= 1:
-            print(f"{indent}  Base case n<=1, returning")
-            return
+        while stack:
+            phase, start, stride, n, level, depth = stack.pop()
             
-        if n == 2:
-            # Single switch
-            swap = self.get_switch_bit(level, start)
-            idx1 = start
-            idx2 = start + stride
+            if phase == PHASE_BOTTOM:
+                # Bottom subnetwork: odd positions after input switches
+                half = n // 2
+                if debug:
+                    indent = "  " * depth
+                    if n % 2 == 0:
+                        print(f"{indent}  Recursive call BOTTOM (even): start={start + stride}, stride={stride * 2}, n={half}")
+                    else:
+                        # For odd n, bottom network has one less element
+                        print(f"{indent}  Recursive call BOTTOM (odd): start={start + stride}, stride={stride * 2}, n={half}")
+                stack.append((PHASE_INPUT, start + stride, stride * 2, half, level + 1, depth + 1))
+                continue
             
-            print(f"{indent}  Base case n=2: swap={swap} at positions {idx1},{idx2}")
+            if phase == PHASE_OUTPUT:
+                # Output switches (one less than input for Waksman property)
+                # First pair has no output switch
+                half = (n + 1) // 2  # Rounded up for odd n, as on the way down
+                num_output_switches = half - 1 if half > 0 else 0
+                if debug:
+                    indent = "  " * depth
+                    print(f"{indent}  Applying {num_output_switches} output switches:")
+                for i in range(1, half):
+                    idx1 = start + (i * 2) * stride
+                    idx2 = start + (i * 2 + 1) * stride
+                    
+                    # Check bounds
+                    if idx2 >= len(array):
+                        if debug:
+                            print(f"{'  ' * depth}    ERROR: idx2={idx2} >= len(array)={len(array)}")
+                        raise IndexError(f"Index {idx2} out of bounds for array of size {len(array)}")
+                        
+                    # Use different level offset to ensure different bits
+                    swap = output_bits[level][idx1]
+                    if debug:
+                        print(f"{indent}    Output switch {i-1}: swap={swap} at positions {idx1},{idx2}")
+                    self.swap_elements(array, idx1, idx2, swap)
+                    self._record_switch(idx1, idx2, swap, SWITCH_OUTPUT, i - 1)
+                continue
             
-            # Check bounds
-            if idx2 >= len(array):
-                print(f"{indent}  ERROR: idx2={idx2} >= len(array)={len(array)}")
-                raise IndexError(f"Index {idx2} out of bounds for array of size {len(array)}")
-                
-            self.swap_elements(array, idx1, idx2, swap)
-            self.switch_history.append((idx1, idx2, swap, f"n=2 base"))
-            return
-            
-        # For n > 2: Waksman recursive structure
-        half = n // 2
-        print(f"{indent}  Recursive case n={n}, half={half}")
-        
-        # Input switches (one per pair)
-        print(f"{indent}  Applying {half} input switches:")
-        for i in range(half):
-            idx1 = start + (i * 2) * stride
-            idx2 = start + (i * 2 + 1) * stride
+            if debug:
+                indent = "  " * depth
+                print(f"{indent}waksman_iterative: start={start}, stride={stride}, n={n}, level={level}")
             
-            # Check bounds
-            if idx2 >= len(array):
-                print(f"{indent}    ERROR: idx2={idx2} >= len(array)={len(array)}")
-                raise IndexError(f"Index {idx2} out of bounds for array of size {len(array)}")
+            # Base cases
+            if n <= 1:
+                if debug:
+                    print(f"{indent}  Base case n<=1, returning")
+                continue
                 
-            swap = self.get_switch_bit(level, idx1)
-            print(f"{indent}    Input switch {i}: swap={swap} at positions {idx1},{idx2}")
-            self.swap_elements(array, idx1, idx2, swap)
-            self.switch_history.append((idx1, idx2, swap, f"input {i}"))
-            
-        # Handle odd n - last element bypasses input switches
-        if n % 2 == 1:
-            print(f"{indent}  Odd n detected, adjusting half from {half} to {(n + 1) // 2}")
-            half = (n + 1) // 2
-            
-        # Recursive calls on interleaved positions
-        # Top subnetwork: even positions after input switches
-        print(f"{indent}  Recursive call TOP: start={start}, stride={stride * 2}, n={half}")
-        self.waksman_recursive(array, start, stride * 2, half, level + 1, depth + 1)
-        
-        # Bottom subnetwork: odd positions after input switches
-        if n % 2 == 0:
-            print(f"{indent}  Recursive call BOTTOM (even): start={start + stride}, stride={stride * 2}, n={half}")
-            self.waksman_recursive(array, start + stride, stride * 2, half, level + 1, depth + 1)
-        else:
-            # For odd n, bottom network has one less element
-            print(f"{indent}  Recursive call BOTTOM (odd): start={start + stride}, stride={stride * 2}, n={half - 1}")
-            self.waksman_recursive(array, start + stride, stride * 2, half - 1, level + 1, depth + 1)
-            
-        # Output switches (one less than input for Waksman property)
-        # First pair has no output switch
-        num_output_switches = half - 1 if half > 0 else 0
-        print(f"{indent}  Applying {num_output_switches} output switches:")
-        for i in range(1, half):
-            idx1 = start + (i * 2) * stride
-            idx2 = start + (i * 2 + 1) * stride
+            if n == 2:
+                # Single switch
+                swap = input_bits[level][start]
+                idx1 = start
+                idx2 = start + stride
+                
+                if debug:
+                    print(f"{indent}  Base case n=2: swap={swap} at positions {idx1},{idx2}")
+                
+                # Check bounds
+                if idx2 >= len(array):
+                    if debug:
+                        print(f"{'  ' * depth}  ERROR: idx2={idx2} >= len(array)={len(array)}")
+                    raise IndexError(f"Index {idx2} out of bounds for array of size {len(array)}")
+                    
+                self.swap_elements(array, idx1, idx2, swap)
+                self._record_switch(idx1, idx2, swap, SWITCH_BASE, 0)
+                continue
+                
+            # For n > 2: Waksman recursive structure
+            half = n // 2
+            if debug:
+                print(f"{indent}  Recursive case n={n}, half={half}")
             
-            # Check bounds
-            if idx2 >= len(array):
-                print(f"{indent}    ERROR: idx2={idx2} >= len(array)={len(array)}")
-                raise IndexError(f"Index {idx2} out of bounds for array of size {len(array)}")
+            # Input switches (one per pair)
+            if debug:
+                print(f"{indent}  Applying {half} input switches:")
+            for i in range(half):
+                idx1 = start + (i * 2) * stride
+                idx2 = start + (i * 2 + 1) * stride
+                
+                # Check bounds
+                if idx2 >= len(array):
+                    if debug:
+                        print(f"{'  ' * depth}    ERROR: idx2={idx2} >= len(array)={len(array)}")
+                    raise IndexError(f"Index {idx2} out of bounds for array of size {len(array)}")
+                    
+                swap = input_bits[level][idx1]
+                if debug:
+                    print(f"{indent}    Input switch {i}: swap={swap} at positions {idx1},{idx2}")
+                self.swap_elements(array, idx1, idx2, swap)
+                self._record_switch(idx1, idx2, swap, SWITCH_INPUT, i)
                 
-            # Use different level offset to ensure different bits
-            swap = self.get_switch_bit(level + 10000, idx1)
-            print(f"{indent}    Output switch {i-1}: swap={swap} at positions {idx1},{idx2}")
-            self.swap_elements(array, idx1, idx2, swap)
-            self.switch_history.append((idx1, idx2, swap, f"output {i-1}"))
+            # Handle odd n - last element bypasses input switches
+            if n % 2 == 1:
+                if debug:
+                    print(f"{indent}  Odd n detected, adjusting half from {half} to {(n + 1) // 2}")
+                half = (n + 1) // 2
+                
+            # Subnetworks on interleaved positions
+            # Top subnetwork: even positions after input switches
+            if debug:
+                print(f"{indent}  Recursive call TOP: start={start}, stride={stride * 2}, n={half}")
+            
+            # Top subnetwork runs first, then the bottom one, then my outputs
+            stack.append((PHASE_OUTPUT, start, stride, n, level, depth))
+            stack.append((PHASE_BOTTOM, start, stride, n, level, depth))
+            stack.append((PHASE_INPUT, start, stride * 2, half, level + 1, depth + 1))
             
     def shuffle(self, array: List) -> List:
         """Main entry point for Waksman shuffle"""
         n = len(array)
-        print(f"\n=== Starting Waksman shuffle for n={n} ===")
-        print(f"Initial array: {array}")
+        if self.debug:
+            print(f"\n=== Starting Waksman shuffle for n={n} ===")
+            print(f"Initial array: {array}")
         
         # Clear switch history
-        self.switch_history = []
+        self._reset_history(n)
         
         # Make a copy to shuffle
         result = array.copy()
         
         # Apply Waksman shuffle
-        self.waksman_recursive(result, 0, 1, n, 0)
+        self.waksman_iterative(result, 0, 1, n, 0)
         
-        print(f"Final array: {result}")
-        print(f"Total switches: {len(self.switch_history)}")
+        if self.debug:
+            print(f"Final array: {result}")
+            print(f"Total switches: {self._hist_count}")
         return result
 
 
 def test_waksman():
     """Test the Waksman shuffle with various sizes"""
-    shuffler = WaksmanShuffle()
+    shuffler = WaksmanShuffle(debug=True)
     
     # Test sizes that work and fail in C
     test_sizes = [2, 3, 4, 5]
@@ -156,6 +243,12 @@ def test_waksman():
                 print(f"✓ Valid permutation for n={n}")
             else:
                 print(f"✗ INVALID result for n={n}: {result}")
+            
+            # Cross-check the layered vectorized implementation
+            if shuffler.shuffle_vectorized(array) == result:
+                print(f"✓ Vectorized shuffle matches for n={n}")
+            else:
+                print(f"✗ Vectorized shuffle MISMATCH for n={n}")
                 
             # Print switch details
             print(f"\nSwitch sequence for n={n}:")
@@ -170,7 +263,7 @@ def test_waksman():
     print("DETAILED TRACE FOR n=3")
     print('='*60)
     
-    shuffler = WaksmanShuffle()
+    shuffler = WaksmanShuffle(debug=True)
     array = [0, 1, 2]
     
     try:
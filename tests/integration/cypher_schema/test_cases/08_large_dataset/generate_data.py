@@ -1,25 +1,31 @@
 #!/usr/bin/env python3
 """Generate large dataset for performance testing."""
 
-import random
+import numpy as np
+
+rng = np.random.default_rng()
 
 # Generate User.csv with 10,000 rows
 # Schema: User(id INT64, name INT32, PRIMARY KEY (id))
 with open('User.csv', 'w') as f:
-    for i in range(1, 10001):
-        f.write(f"{i},{i}\n")
+    f.write("".join(f"{i},{i}\n" for i in range(1, 10001)))
 
 # Generate Follows.csv with 50,000 rows
 with open('Follows.csv', 'w') as f:
-    follows_set = set()
-    while len(follows_set) < 50000:
-        src = random.randint(1, 10000)
-        dest = random.randint(1, 10000)
-        if src != dest:  # No self-follows
-            follows_set.add((src, dest))
+    # Draw candidate pairs in bulk, drop self-follows and keep the first
+    # occurrence of each duplicate until 50,000 unique pairs remain
+    pairs = np.empty((0, 2), dtype=np.int64)
+    while len(pairs) < 50000:
+        batch = rng.integers(1, 10001, size=(70000, 2))
+        batch = batch[batch[:, 0] != batch[:, 1]]  # No self-follows
+        pairs = np.concatenate([pairs, batch])
+        _, first = np.unique(pairs, axis=0, return_index=True)
+        pairs = pairs[np.sort(first)]
+    pairs = pairs[:50000]
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]  # Sort by (src, dest)
 
-    for src, dest in sorted(follows_set):
-        timestamp = random.randint(2020, 2024)
-        f.write(f"{src},{dest},{timestamp}\n")
+    timestamps = rng.integers(2020, 2025, size=len(pairs)).tolist()
+    f.write("".join(f"{src},{dest},{timestamp}\n"
+                    for (src, dest), timestamp in zip(pairs.tolist(), timestamps)))
 
 print("Generated User.csv (10,000 rows) and Follows.csv (50,000 rows)")
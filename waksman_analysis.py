@@ -5,125 +5,433 @@ Analyzes generalized K-way permutation networks where each switch performs rando
 """
 
 import numpy as np
-import random
-from collections import defaultdict
+import os
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
 import math
 
-class KWayNetwork:
-    def __init__(self, n, k=2):
-        """Initialize K-way network for n inputs with radix k"""
-        self.n = n
-        self.k = k
-        self.switches = {}  # Dictionary to store switch permutations
-        
-    def set_random_switches(self):
-        """Set all switches to random K-way permutations"""
-        self.switches = {}
-        self._set_random_recursive(0, self.n, 0)
-        
-    def _set_random_recursive(self, start, size, depth):
-        """Recursively set random K-way switches"""
+# Distinct permutations are counted exactly while all realized rows
+# (num_trials * n entries) fit under this limit, and estimated with a
+# HyperLogLog sketch of 2**HLL_PRECISION registers above it
+EXACT_UNIQUE_LIMIT = 1 << 22
+HLL_PRECISION = 14
+
+
+@lru_cache(maxsize=None)
+def _group_layout(size, k):
+    """Group sizes, their prefix sums and a group lookup for a node
+    
+    The split depends only on size and K. prefix[i] is the offset of group i
+    in the node, prefix[-1] is size. group_lut[j] is the group holding local
+    position j.
+    """
+    # Calculate sub-array sizes
+    base_size = size // k
+    remainder = size % k
+    group_sizes = [base_size + (1 if i < remainder else 0) for i in range(k)]
+    
+    # Remove empty groups
+    non_empty_groups = tuple(s for s in group_sizes if s > 0)
+    prefix = [0]
+    for gsize in non_empty_groups:
+        prefix.append(prefix[-1] + gsize)
+    group_lut = tuple(i for i, gsize in enumerate(non_empty_groups)
+                      for _ in range(gsize))
+    
+    return non_empty_groups, tuple(prefix), group_lut
+
+
+@lru_cache(maxsize=None)
+def _factorial_float(n):
+    """n! as a float for ratios (inf past 20, where it is never displayed)"""
+    return float(math.factorial(n)) if n <= 20 else float('inf')
+
+
+def _range_xor(n):
+    """XOR of 0, 1, ..., n-1 (closed form by n mod 4)"""
+    m = n - 1
+    return (m, 1, m + 1, 0)[m % 4] if n > 0 else 0
+
+
+@lru_cache(maxsize=None)
+def _build_tree_layout(n, k):
+    """Structure of an (n, k) network, shared by every configuration
+    
+    Returns (nodes, offsets, slot_offsets, slot_local, slot_is_leaf, node_slots):
+    - nodes: (switch key, switch size) for every switch, in preorder
+    - offsets: start of each switch in a flat buffer of all switch slots
+    - slot_offsets, slot_local: per slot, its switch's offset and its index
+      within that switch
+    - slot_is_leaf: per slot, whether it belongs to a leaf switch
+    - node_slots[depth, start]: offset of the switch at (depth, start)
+    The arrays are shared between callers and must not be modified.
+    """
+    # With fewer than 2 groups a node never shrinks and the walk never ends
+    if k < 2:
+        raise ValueError(f"K-way network needs k >= 2, got k={k}")
+    
+    nodes = []
+    
+    # Preorder walk with an explicit stack of (start, size, depth) frames;
+    # sub-arrays are pushed in reverse so they pop in left-to-right order
+    stack = [(0, n, 0)]
+    while stack:
+        start, size, depth = stack.pop()
         if size <= 1:
-            return
+            continue
             
         # If size <= K, single K-way shuffle
-        if size <= self.k:
-            perm = list(range(size))
-            random.shuffle(perm)
-            self.switches[(depth, start, size)] = perm
-            return
+        if size <= k:
+            nodes.append(((depth, start, size), size))
+            continue
         
-        # Calculate sub-array sizes
-        base_size = size // self.k
-        remainder = size % self.k
-        group_sizes = [base_size + (1 if i < remainder else 0) for i in range(self.k)]
+        # Switch for group-level shuffle, then the sub-arrays
+        non_empty_groups, prefix, _ = _group_layout(size, k)
+        nodes.append(((depth, start, 'groups'), len(non_empty_groups)))
+        for gsize, offset in zip(reversed(non_empty_groups), reversed(prefix[:-1])):
+            stack.append((start + offset, gsize, depth + 1))
+    
+    sizes = np.array([size for _, size in nodes], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    slot_offsets = np.repeat(offsets[:-1], sizes)
+    slot_local = np.arange(offsets[-1]) - slot_offsets
+    slot_is_leaf = np.repeat([key[2] != 'groups' for key, _ in nodes], sizes).astype(bool)
+    
+    num_levels = 1 + max((key[0] for key, _ in nodes), default=0)
+    node_slots = np.zeros((num_levels, max(n, 1)), dtype=np.int64)
+    for ((depth, start, _), _), offset in zip(nodes, offsets):
+        node_slots[depth, start] = offset
+    
+    return (tuple(nodes), tuple(offsets.tolist()), slot_offsets, slot_local,
+            slot_is_leaf, node_slots)
+
+
+@lru_cache(maxsize=None)
+def _node_index(n, k):
+    """Dense switch id for each node: node_index[depth][start] is the
+    position of the switch at (depth, start) in the preorder node list, or -1
+    where there is none. Nested tuples, for fast indexing from Python.
+    """
+    nodes = _build_tree_layout(n, k)[0]
+    num_levels = 1 + max((key[0] for key, _ in nodes), default=0)
+    table = [[-1] * max(n, 1) for _ in range(num_levels)]
+    for node_id, ((depth, start, _), _) in enumerate(nodes):
+        table[depth][start] = node_id
+    return tuple(tuple(row) for row in table)
+
+
+def _random_switch_slots(n, k, num_configs, rng):
+    """Draw independent random switch settings for num_configs networks
+    
+    Returns (perms, inverses), each (num_configs, num_slots) in the flat slot
+    layout of _build_tree_layout(n, k): every switch's permutation and its
+    inverse. Each slot gets a random key in [0, 1) plus its switch's offset,
+    so one argsort per row shuffles every switch independently and uniformly.
+    """
+    _, offsets, slot_offsets, slot_local, _, _ = _build_tree_layout(n, k)
+    keys = rng.random((num_configs, offsets[-1]))
+    keys += slot_offsets
+    order = np.argsort(keys, axis=1)
+    del keys
+    
+    inverses = np.empty_like(order)
+    np.put_along_axis(inverses, order, np.broadcast_to(slot_local, order.shape), axis=1)
+    
+    # order[j] - offset is perm[j - offset] within each switch; shift the
+    # argsort result in place rather than allocating another batch array
+    order -= slot_offsets
+    return order, inverses
+
+
+def _route_batch(n, k, route_slots):
+    """Route all inputs of a batch of configurations, one level per step
+    
+    route_slots[c] is configuration c in the flat slot layout, holding the
+    group permutation for group switches and the inverse permutation for
+    leaf switches. Every input descends one level per step, so a step is a
+    few NumPy gathers over the inputs still inside a group node. Group
+    indices and offsets use the closed form of the even split (K groups of
+    size size // K, the first size % K of them one larger). Row c of the
+    (num_configs, n) result equals [route(i) for i in range(n)] under
+    configuration c, including the out-of-range routes of invalid ones.
+    """
+    num_configs = len(route_slots)
+    pos = np.tile(np.arange(n), num_configs)
+    if n <= 1:
+        return pos.reshape(num_configs, n)
+    
+    node_slots = _build_tree_layout(n, k)[5]
+    slots = route_slots.ravel()
+    row = np.repeat(np.arange(num_configs) * route_slots.shape[1], n)
+    start = np.zeros_like(pos)
+    size = np.full_like(pos, n)
+    active = np.arange(pos.size)  # Inputs not yet at a leaf
+    depth = 0
+    
+    while active.size:
+        s = start[active]
+        sz = size[active]
+        local = pos[active] - s
+        switch = row[active] + node_slots[depth, s]
         
-        # Remove empty groups
-        non_empty_groups = [s for s in group_sizes if s > 0]
-        num_groups = len(non_empty_groups)
+        # Leaf switches: slots hold the inverse permutation
+        leaf = sz <= k
+        hit = leaf & (local < sz)
+        pos[active[hit]] = s[hit] + slots[switch[hit] + local[hit]]
         
-        # Set switch for group-level shuffle
-        group_perm = list(range(num_groups))
-        random.shuffle(group_perm)
-        self.switches[(depth, start, 'groups')] = group_perm
+        # Group nodes: move into the permuted group, keeping the offset
+        inner = ~leaf
+        active, s, sz, local, switch = (active[inner], s[inner], sz[inner],
+                                        local[inner], switch[inner])
+        if k == 2:
+            # Two groups: the first of ceil(size / 2), the second of the rest
+            first = sz - (sz >> 1)
+            group_idx = (local >= first) & (local < sz)
+            new_group_idx = slots[switch + group_idx]
+            new_start = s + new_group_idx * first
+            pos[active] = new_start + local - group_idx * first
+            start[active] = new_start
+            size[active] = np.where(new_group_idx, sz >> 1, first)
+        else:
+            base = sz // k
+            rem = sz % k
+            cut = rem * (base + 1)
+            group_idx = np.where(local < cut, local // (base + 1),
+                                 rem + (local - cut) // base)
+            group_idx[local >= sz] = 0  # Past the end: the scan's default
+            new_group_idx = slots[switch + group_idx]
+            new_start = s + new_group_idx * base + np.minimum(new_group_idx, rem)
+            pos[active] = new_start + local - (group_idx * base + np.minimum(group_idx, rem))
+            start[active] = new_start
+            size[active] = base + (new_group_idx < rem)
         
-        # Recursively set switches for sub-arrays
-        curr_pos = start
-        for gsize in non_empty_groups:
-            self._set_random_recursive(curr_pos, gsize, depth + 1)
-            curr_pos += gsize
+        active = active[size[active] > 1]
+        depth += 1
     
-    def route(self, input_pos):
-        """Route an input position through the network"""
-        return self._route_recursive(input_pos, 0, self.n, 0)
+    return pos.reshape(num_configs, n)
+
+
+class _SwitchesView(MutableMapping):
+    """Dict-like view of a KWayNetwork's switches, keyed by
+    (depth, start, size or 'groups')
+    
+    Reads see the current configuration. Assigning a key replaces that
+    switch and deleting it leaves the switch to be drawn on first use; keys
+    that name no switch of the network raise KeyError. Change a switch by
+    assigning a new perm, not by editing the returned list in place.
+    """
+    
+    def __init__(self, network):
+        self._network = network
+    
+    def __getitem__(self, key):
+        perm = self._network._perms[self._network._switch_node(key)]
+        if perm is None:
+            raise KeyError(key)
+        return perm
     
-    def _route_recursive(self, pos, start, size, depth):
-        """Recursively route through K-way network"""
-        if size <= 1:
-            return pos  # Return actual position
-            
-        # If size <= K, single K-way shuffle
-        if size <= self.k:
-            perm = self.switches.get((depth, start, size))
-            if perm is None:
-                # Generate if not exists
-                perm = list(range(size))
-                random.shuffle(perm)
-                self.switches[(depth, start, size)] = perm
-            
-            local_pos = pos - start
-            # Find where local_pos goes in the permutation
-            for i in range(size):
-                if perm[i] == local_pos:
-                    return start + i
-            return pos  # Shouldn't happen
+    def __setitem__(self, key, perm):
+        self._network._set_switch(self._network._switch_node(key), perm)
+    
+    def __delitem__(self, key):
+        node_id = self._network._switch_node(key)
+        if self._network._perms[node_id] is None:
+            raise KeyError(key)
+        self._network._perms[node_id] = None
+        self._network._inverses[node_id] = None
+    
+    def __iter__(self):
+        network = self._network
+        return iter([key for (key, _), perm in zip(network._nodes, network._perms)
+                     if perm is not None])
+    
+    def __len__(self):
+        return sum(perm is not None for perm in self._network._perms)
+
+
+class KWayNetwork:
+    def __init__(self, n, k=2, rng=None):
+        """Initialize K-way network for n inputs with radix k
         
-        # Split into K groups as evenly as possible
-        base_size = size // self.k
-        remainder = size % self.k
-        group_sizes = [base_size + (1 if i < remainder else 0) for i in range(self.k)]
+        Switch settings are drawn from rng (an np.random.Generator); a fresh
+        generator is created when none is given.
+        """
+        self.n = n
+        self.k = k
+        self.rng = rng if rng is not None else np.random.default_rng()
+        # Switch storage indexed by node id (see _node_index): the
+        # permutation of each switch and its inverse, None until drawn
+        self._node_index = _node_index(n, k)
+        self._nodes = _build_tree_layout(n, k)[0]
+        self._perms = [None] * len(self._nodes)
+        self._inverses = [None] * len(self._nodes)
+    
+    @property
+    def switches(self):
+        """Live view of the drawn switch permutations, keyed by
+        (depth, start, size or 'groups'); see _SwitchesView"""
+        return _SwitchesView(self)
+    
+    @switches.setter
+    def switches(self, switches):
+        """Replace the switch configuration, e.g. to inject one for debugging
         
-        # Remove empty groups
-        non_empty_groups = [s for s in group_sizes if s > 0]
-        num_groups = len(non_empty_groups)
+        Switches left out are drawn on first use.
+        """
+        # Resolve every key first so a bad one leaves the network untouched
+        entries = [(self._switch_node(key), perm) for key, perm in switches.items()]
+        self._perms = [None] * len(self._nodes)
+        self._inverses = [None] * len(self._nodes)
+        for node_id, perm in entries:
+            self._set_switch(node_id, perm)
+    
+    def _switch_node(self, key):
+        """Node id of the switch named by key; KeyError if there is none"""
+        depth, start = key[0], key[1]
+        if (0 <= depth < len(self._node_index)
+                and 0 <= start < len(self._node_index[depth])):
+            node_id = self._node_index[depth][start]
+            if node_id >= 0 and self._nodes[node_id][0] == key:
+                return node_id
+        raise KeyError(key)
+    
+    def _set_switch(self, node_id, perm):
+        """Store a given perm (and its inverse) for a node
         
-        # Find which group this element belongs to
-        local_pos = pos - start
-        group_idx = 0
-        offset = 0
-        for i, gsize in enumerate(non_empty_groups):
-            if local_pos < offset + gsize:
-                group_idx = i
-                break
-            offset += gsize
+        A leaf input whose position no perm entry names stays in place, and
+        with repeated entries the first one wins, as in a linear search;
+        leaf entries outside range(size) are ignored.
+        """
+        perm = list(perm)
+        inv = list(range(len(perm)))
+        for i in reversed(range(len(perm))):
+            if 0 <= perm[i] < len(perm):
+                inv[perm[i]] = i
+        self._perms[node_id] = perm
+        self._inverses[node_id] = inv
         
-        # Get or create permutation for groups at this level
-        switch_key = (depth, start, 'groups')
-        if switch_key not in self.switches:
-            group_perm = list(range(num_groups))
-            random.shuffle(group_perm)
-            self.switches[switch_key] = group_perm
+    def set_random_switches(self):
+        """Set all switches to random K-way permutations
         
-        group_perm = self.switches[switch_key]
+        All switches are drawn in one batch by _random_switch_slots.
+        """
+        nodes, offsets = _build_tree_layout(self.n, self.k)[:2]
+        if not nodes:
+            return
         
-        # Find where this group maps to
-        new_group_idx = group_perm[group_idx]
+        perms, inverses = _random_switch_slots(self.n, self.k, 1, self.rng)
+        perms = perms[0].tolist()
+        invs = inverses[0].tolist()
         
-        # Calculate offset for new group
-        new_offset = sum(non_empty_groups[:new_group_idx])
+        self._perms = [perms[lo:hi] for lo, hi in zip(offsets, offsets[1:])]
+        self._inverses = [invs[lo:hi] for lo, hi in zip(offsets, offsets[1:])]
+    
+    def _new_switch(self, node_id, size):
+        """Store a random permutation of range(size) and its inverse for a node"""
+        perm = self.rng.permutation(size).tolist()
+        inv = [0] * size
+        for i, v in enumerate(perm):
+            inv[v] = i
+        self._perms[node_id] = perm
+        self._inverses[node_id] = inv
+        return perm
+    
+    def route(self, input_pos):
+        """Route an input position through the network"""
+        if self.k == 2:
+            return self._route_binary(input_pos, 0, self.n, 0)
+        return self._route_walk(input_pos, 0, self.n, 0)
+    
+    def _route_binary(self, pos, start, size, depth):
+        """_route_walk specialized to K=2
         
-        # Position within the group (stays the same)
-        within_group_pos = local_pos - sum(non_empty_groups[:group_idx])
+        A group node has two groups, the first of ceil(size / 2), and its
+        switch either keeps or swaps them, so the group index is one
+        comparison and the move is a single offset.
+        """
+        while size > 2:
+            node_id = self._node_index[depth][start]
+            group_perm = self._perms[node_id]
+            if group_perm is None:
+                group_perm = self._new_switch(node_id, 2)
+            
+            first = size - (size >> 1)
+            local_pos = pos - start
+            group_idx = 1 if first <= local_pos < size else 0
+            
+            if group_perm[group_idx]:
+                pos = start + first + local_pos - (first if group_idx else 0)
+                start += first
+                size >>= 1
+            else:
+                pos = start + local_pos - (first if group_idx else 0)
+                size = first
+            depth += 1
         
-        # Recursively route within the new group
-        final_pos = self._route_recursive(
-            start + new_offset + within_group_pos,
-            start + new_offset,
-            non_empty_groups[new_group_idx],
-            depth + 1
-        )
+        if size <= 1:
+            return pos
         
-        return final_pos
+        # Leaf: a single 2-way switch
+        node_id = self._node_index[depth][start]
+        inv = self._inverses[node_id]
+        if inv is None:
+            self._new_switch(node_id, 2)
+            inv = self._inverses[node_id]
+        local_pos = pos - start
+        if local_pos < 2:
+            return start + inv[local_pos]
+        return pos  # Shouldn't happen
+    
+    def _route_walk(self, pos, start, size, depth):
+        """Route through K-way network, one level per loop iteration"""
+        while True:
+            if size <= 1:
+                return pos  # Return actual position
+                
+            # If size <= K, single K-way shuffle
+            node_id = self._node_index[depth][start]
+            if size <= self.k:
+                inv = self._inverses[node_id]
+                if inv is None:
+                    # Generate if not exists
+                    self._new_switch(node_id, size)
+                    inv = self._inverses[node_id]
+                
+                local_pos = pos - start
+                # Find where local_pos goes in the permutation (perm[i] == local_pos)
+                if local_pos < size:
+                    return start + inv[local_pos]
+                return pos  # Shouldn't happen
+            
+            # Split into K groups as evenly as possible
+            non_empty_groups, prefix, group_lut = _group_layout(size, self.k)
+            num_groups = len(non_empty_groups)
+            
+            # Find which group this element belongs to (group 0 past the end)
+            local_pos = pos - start
+            group_idx = group_lut[local_pos] if local_pos < size else 0
+            
+            # Get or create permutation for groups at this level
+            group_perm = self._perms[node_id]
+            if group_perm is None:
+                group_perm = self._new_switch(node_id, num_groups)
+            
+            # Find where this group maps to
+            new_group_idx = group_perm[group_idx]
+            
+            # Calculate offset for new group
+            new_offset = prefix[new_group_idx]
+            
+            # Position within the group (stays the same)
+            within_group_pos = local_pos - prefix[group_idx]
+            
+            # Continue routing within the new group
+            pos = start + new_offset + within_group_pos
+            start = start + new_offset
+            size = non_empty_groups[new_group_idx]
+            depth += 1
     
     def apply_permutation(self, input_array):
         """Apply the K-way network to permute the input array"""
@@ -131,82 +439,224 @@ class KWayNetwork:
         if n <= 1:
             return input_array.copy()
         
+        # Zero-filled (not empty) so outputs nobody routes to stay 0; on
+        # collisions the later input wins, as with sequential writes
         result = np.zeros_like(input_array)
-        for i in range(n):
-            final_pos = self.route(i)
-            result[final_pos] = input_array[i]
-        
+        result[self.get_permutation_vec()] = input_array
+
         return result
     
+    def get_permutation_vec(self):
+        """Route all inputs at once with _route_batch; returns an int64 array
+
+        Missing switches are created first, as route() would.
+        """
+        route_slots = []
+        for node_id, (switch_key, size) in enumerate(self._nodes):
+            if self._perms[node_id] is None:
+                self._new_switch(node_id, size)
+            if switch_key[2] == 'groups':
+                route_slots.extend(self._perms[node_id])
+            else:
+                route_slots.extend(self._inverses[node_id])
+
+        route_slots = np.array(route_slots, dtype=np.int64).reshape(1, -1)
+        return _route_batch(self.n, self.k, route_slots)[0]
+
     def get_permutation(self):
         """Get the full permutation realized by current switch settings"""
-        perm = []
-        for i in range(self.n):
-            perm.append(self.route(i))
-        return perm
+        return self.get_permutation_vec().tolist()
     
-    def check_validity(self):
-        """Check if current configuration produces a valid permutation"""
-        perm = self.get_permutation()
-        # Check if all outputs are covered exactly once
-        return sorted(perm) == list(range(self.n))
+    def check_validity(self, perm=None):
+        """Check if current configuration produces a valid permutation
+        
+        Pass perm when the permutation has already been computed.
+        """
+        if perm is None:
+            perm = self.get_permutation_vec()
+        perm = np.asarray(perm)
+        
+        # Check if all outputs are covered exactly once: n in-range outputs
+        # that leave no output unmarked
+        if len(perm) != self.n or ((perm < 0) | (perm >= self.n)).any():
+            return False
+        # A permutation of range(n) has a fixed sum and XOR; most invalid
+        # configurations fail one of these before the bitmap is needed
+        if (int(perm.sum()) != self.n * (self.n - 1) // 2
+                or int(np.bitwise_xor.reduce(perm)) != _range_xor(self.n)):
+            return False
+        seen = np.zeros(self.n, dtype=bool)
+        seen[perm] = True
+        return bool(seen.all())
+
+
+def _distinct_rows(rows):
+    """Distinct rows of a 2-D non-negative integer array, in no set order
+    
+    Each row is reduced to one sortable key: a mixed-radix int64 code (Horner
+    over the row) when it fits, otherwise the row's raw bytes. One 1-D
+    np.unique over the keys then replaces hashing a tuple per row.
+    """
+    num_rows, width = rows.shape
+    if num_rows == 0 or width == 0:
+        return rows[:1]
+    
+    radix = int(rows.max()) + 1
+    if radix ** width < 2 ** 63:
+        keys = rows @ radix ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    else:
+        rows = np.ascontiguousarray(rows)
+        keys = rows.view(np.dtype((np.void, rows.itemsize * width))).ravel()
+    _, first = np.unique(keys, return_index=True)
+    return rows[first]
+
+
+def _mix64(x):
+    """splitmix64 finalizer over a uint64 array (wrapping arithmetic)"""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _hll_registers(rows):
+    """HyperLogLog registers for the rows of a 2-D non-negative integer array
+    
+    Each row is hashed to 64 bits by folding its columns through _mix64. The
+    top HLL_PRECISION bits pick a register, which keeps the largest rank
+    (position of the first set bit) seen in the remaining bits. Sketches of
+    separate batches merge with np.maximum.
+    """
+    registers = np.zeros(1 << HLL_PRECISION, dtype=np.uint8)
+    if rows.size == 0:
+        return registers
+    
+    h = np.full(len(rows), 0x9E3779B97F4A7C15, dtype=np.uint64)
+    for col in rows.T.astype(np.uint64):
+        h = _mix64(h ^ col)
+    
+    tail_bits = 64 - HLL_PRECISION
+    index = (h >> np.uint64(tail_bits)).astype(np.intp)
+    tail = h & np.uint64((1 << tail_bits) - 1)
+    # The tail fits a float64 exactly, so frexp's exponent is its bit length
+    rank = tail_bits + 1 - np.frexp(tail.astype(np.float64))[1]
+    np.maximum.at(registers, index, rank.astype(np.uint8))
+    return registers
 
 
-def analyze_kway_network(n, k, num_trials=10000):
+def _hll_estimate(registers):
+    """Cardinality estimate from HyperLogLog registers
+    
+    Uses linear counting while the estimate is small and registers are still
+    empty; 64-bit hashes need no large-range correction.
+    """
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.ldexp(1.0, -registers.astype(np.int64)).sum()
+    zeros = int((registers == 0).sum())
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return int(round(estimate))
+
+
+def _run_trials(n, k, num_trials, seed, exact=True):
+    """Run a batch of random-switch trials (in a worker process)
+    
+    All trials are drawn and routed together as one (num_trials, n) array.
+    Returns (number of valid permutations, distinct realized permutations as
+    rows of an array, n x n count of input i landing on output j). With
+    exact=False the realized permutations come back as HyperLogLog registers
+    (see _hll_registers) instead of distinct rows.
+    """
+    rng = np.random.default_rng(seed)
+    slot_is_leaf = _build_tree_layout(n, k)[4]
+    perms, inverses = _random_switch_slots(n, k, num_trials, rng)
+    # Leaf switches route through the inverse; overwrite those slots of
+    # perms in place to get the routing layout without a third buffer
+    np.copyto(perms, inverses, where=slot_is_leaf)
+    del inverses
+    routed = _route_batch(n, k, perms)
+    
+    # Track where each input goes (outputs past n are never reported)
+    in_range = routed < n
+    cells = (np.arange(n) * n + routed)[in_range]
+    position_distribution = np.bincount(cells, minlength=n * n).reshape(n, n)
+    
+    # Check validity: every output in range and every output hit. Rows whose
+    # sum or XOR differs from that of range(n) are rejected outright; only
+    # the rest go through the bitmap
+    candidate = (in_range.all(axis=1)
+                 & (routed.sum(axis=1) == n * (n - 1) // 2)
+                 & (np.bitwise_xor.reduce(routed, axis=1) == _range_xor(n)))
+    candidate_rows = routed[candidate]
+    seen = np.zeros(candidate_rows.shape, dtype=bool)
+    np.put_along_axis(seen, candidate_rows, True, axis=1)
+    valid = seen.all(axis=1)
+    
+    seen = _distinct_rows(routed) if exact else _hll_registers(routed)
+    return int(valid.sum()), seen, position_distribution
+
+
+def analyze_kway_network(n, k, num_trials=10000, seed=None):
     """Analyze behavior of K-way network with random switches"""
     print(f"\n=== Analyzing {k}-Way Network with n={n}, {num_trials} trials ===\n")
     
     # Track statistics
     valid_perms = 0
-    seen_perms = set()
-    position_distribution = defaultdict(lambda: defaultdict(int))
-    
-    for trial in range(num_trials):
-        network = KWayNetwork(n, k)
-        network.set_random_switches()
-        
-        perm = network.get_permutation()
-        perm_tuple = tuple(perm)
-        seen_perms.add(perm_tuple)
-        
-        # Track where each input goes
-        for inp, out in enumerate(perm):
-            position_distribution[inp][out] += 1
-        
-        # Check validity
-        if network.check_validity():
-            valid_perms += 1
+    seen_perms = []
+    position_distribution = np.zeros((n, n), dtype=np.int64)
+    
+    # Trials are independent: split them into a few batches per core, each
+    # with its own seed, and merge the results here
+    workers = os.cpu_count() or 1
+    num_batches = max(1, min(num_trials, workers * 4))
+    batch_sizes = [num_trials // num_batches + (1 if i < num_trials % num_batches else 0)
+                   for i in range(num_batches)]
+    seeds = np.random.SeedSequence(seed).spawn(num_batches)
+    
+    # Keep every distinct row only while that stays small; otherwise each
+    # batch returns a fixed-size sketch
+    exact = num_trials * n <= EXACT_UNIQUE_LIMIT
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch_valid, perms, batch_distribution in executor.map(
+                _run_trials, repeat(n), repeat(k), batch_sizes, seeds,
+                repeat(exact)):
+            valid_perms += batch_valid
+            seen_perms.append(perms)
+            position_distribution += batch_distribution
     
     # Calculate statistics
-    total_possible = math.factorial(n)
-    unique_seen = len(seen_perms)
+    total_possible = math.factorial(n) if n <= 20 else None
+    if exact:
+        unique_seen = len(_distinct_rows(np.concatenate(seen_perms)))
+    else:
+        unique_seen = _hll_estimate(np.maximum.reduce(seen_perms))
     
     print(f"Valid permutations: {valid_perms}/{num_trials} ({100*valid_perms/num_trials:.2f}%)")
-    print(f"Unique permutations seen: {unique_seen:,}")
+    if exact:
+        print(f"Unique permutations seen: {unique_seen:,}")
+    else:
+        print(f"Unique permutations seen: ~{unique_seen:,} (HyperLogLog estimate)")
     if n <= 20:
         print(f"Total possible: {total_possible:,}")
-        print(f"Coverage: {100*unique_seen/total_possible:.4f}%")
+        print(f"Coverage: {100*unique_seen/_factorial_float(n):.4f}%")
     else:
         print(f"Total possible: {n}! (too large to compute)")
     
     # Check uniformity
     print("\nUniformity Analysis:")
     
-    # Calculate entropy for a few positions
+    # One n x n probability array feeds every statistic below
+    probs = position_distribution / num_trials
+    
+    # Calculate entropy for a few positions (0 * log 0 counts as 0)
     sample_positions = min(5, n)
-    avg_entropy = 0
-    
-    for i in range(sample_positions):
-        probs = []
-        for j in range(n):
-            if position_distribution[i][j] > 0:
-                p = position_distribution[i][j] / num_trials
-                probs.append(p)
-        
-        entropy = -sum(p * np.log2(p) for p in probs if p > 0)
-        avg_entropy += entropy
-        
-    avg_entropy /= sample_positions
+    with np.errstate(divide='ignore'):
+        logp = np.where(probs > 0, np.log2(probs), 0.0)
+    entropies = -(probs[:sample_positions] * logp[:sample_positions]).sum(axis=1)
+    avg_entropy = entropies.mean()
     max_entropy = np.log2(n)
     
     print(f"Average entropy (first {sample_positions} positions): {avg_entropy:.3f}")
@@ -214,22 +664,16 @@ def analyze_kway_network(n, k, num_trials=10000):
     print(f"Uniformity ratio: {100*avg_entropy/max_entropy:.1f}%")
     
     # Check distribution spread
-    all_probs = []
-    for i in range(n):
-        for j in range(n):
-            prob = position_distribution[i][j] / num_trials
-            all_probs.append(prob)
-    
     expected_prob = 1.0 / n
-    std_dev = np.std(all_probs)
-    max_deviation = max(abs(p - expected_prob) for p in all_probs)
+    std_dev = probs.std()
+    max_deviation = np.abs(probs - expected_prob).max()
     
     print(f"\nDistribution Statistics:")
     print(f"Expected probability (uniform): {expected_prob:.4f}")
     print(f"Actual std deviation: {std_dev:.4f}")
     print(f"Maximum deviation from expected: {max_deviation:.4f}")
     
-    return valid_perms, unique_seen, total_possible if n <= 20 else None
+    return valid_perms, unique_seen, total_possible
 
 
 def test_specific_cases():
@@ -261,7 +705,7 @@ def test_specific_cases():
             'unique': unique,
             'total': total,
             'valid_rate': 100 * valid / num_trials,
-            'coverage': 100 * unique / total if total else None
+            'coverage': 100 * unique / _factorial_float(n) if total else None
         })
     
     # Summary table
@@ -290,7 +734,7 @@ def test_simple_example():
         input_array = np.arange(6)
         output = network.apply_permutation(input_array)
         perm = network.get_permutation()
-        valid = "VALID" if network.check_validity() else "INVALID"
+        valid = "VALID" if network.check_validity(perm) else "INVALID"
         
         print(f"\nTrial {i+1}:")
         print(f"  Input:  {input_array}")
@@ -334,11 +778,12 @@ def test_odd_sizes():
         network = KWayNetwork(n, k)
         network.set_random_switches()
         perm = network.get_permutation()
-        valid = "VALID" if network.check_validity() else "INVALID"
+        is_valid = network.check_validity(perm)
+        valid = "VALID" if is_valid else "INVALID"
         print(f"Example permutation: {perm} ({valid})")
         
         # Check for duplicates/missing
-        if not network.check_validity():
+        if not is_valid:
             seen = {}
             for i, p in enumerate(perm):
                 if p in seen:
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Shared pieces of the Python Waksman shuffle test scripts
+Switch bits, cached switch tables, the layered vectorized shuffle and the
+switch history, common to test_waksman_python.py and test_waksman_fixed.py
+"""
+
+import math
+import random
+from typing import List, Tuple
+
+import numpy as np
+
+# Switch kinds recorded in the switch history
+SWITCH_BASE = 0
+SWITCH_INPUT = 1
+SWITCH_OUTPUT = 2
+
+# Phases of a group frame on the iterative driver's stack
+PHASE_INPUT = 0
+PHASE_BOTTOM = 1
+PHASE_OUTPUT = 2
+
+class WaksmanShuffleBase:
+    """
+    Everything but the network shape
+
+    Subclasses provide build_switch_layers(n), waksman_iterative(...) and
+    shuffle(array), which differ between the original and fixed variants.
+    """
+
+    def __init__(self, seed=42, debug=False):
+        """Initialize with deterministic RNG for testing"""
+        self.rng = random.Random(seed)
+        self.debug = debug  # Print a per-switch trace when True
+        self._schedules = {}  # n -> cached switch_schedule(n)
+        self._luts = {}  # (n, num_levels) -> cached switch_lut(n, num_levels)
+        self._reset_history(0)
+
+    def get_switch_bit(self, level: int, position: int) -> int:
+        """Get deterministic switch bit based on level and position"""
+        # Use a simple hash for deterministic switches
+        hash_val = (level * 1000 + position) % 100
+        return 1 if hash_val < 50 else 0
+
+    def get_switch_bits(self, level: int, positions: np.ndarray) -> np.ndarray:
+        """Vectorized get_switch_bit over an array of positions"""
+        hash_val = (level * 1000 + positions) % 100
+        return hash_val < 50
+
+    def build_switch_lut(self, n: int, num_levels: int) -> Tuple[List[List[int]], List[List[int]]]:
+        """
+        Precompute get_switch_bit for levels 0..num_levels-1 and positions 0..n-1
+
+        Returns (input_bits, output_bits) with input_bits[level][pos] equal to
+        get_switch_bit(level, pos) and output_bits[level][pos] equal to
+        get_switch_bit(level + 10000, pos). Nested lists keep the per-switch
+        lookup a plain index instead of a method call.
+        """
+        levels = np.arange(num_levels)[:, None]
+        positions = np.arange(n)
+        input_bits = self.get_switch_bits(levels, positions)
+        output_bits = self.get_switch_bits(levels + 10000, positions)
+        return (input_bits.astype(np.uint8).tolist(),
+                output_bits.astype(np.uint8).tolist())
+
+    def switch_lut(self, n: int, num_levels: int) -> Tuple[List[List[int]], List[List[int]]]:
+        """Cached build_switch_lut(n, num_levels), reused across shuffles"""
+        lut = self._luts.get((n, num_levels))
+        if lut is None:
+            lut = self.build_switch_lut(n, num_levels)
+            self._luts[(n, num_levels)] = lut
+        return lut
+
+    def build_switch_layers(self, n: int) -> Tuple[List, List]:
+        """Per-level switch layers of the network, see the subclasses"""
+        raise NotImplementedError
+
+    def switch_schedule(self, n: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[int]]:
+        """
+        Cached, flattened form of build_switch_layers(n)
+
+        All layers are concatenated into one idx1/idx2 index pair and a single
+        switch bitmap, so repeated shuffles of the same size reuse one
+        precomputed schedule. Layer k spans offsets[k]:offsets[k + 1].
+        Returns (idx1, idx2, swap, offsets).
+        """
+        schedule = self._schedules.get(n)
+        if schedule is None:
+            input_layers, output_layers = self.build_switch_layers(n)
+            layers = input_layers + output_layers
+            offsets = [0]
+            for idx1, _, _ in layers:
+                offsets.append(offsets[-1] + len(idx1))
+            empty = [np.empty(0, dtype=np.int64)]
+            schedule = (np.concatenate([l[0] for l in layers] or empty),
+                        np.concatenate([l[1] for l in layers] or empty),
+                        np.concatenate([l[2] for l in layers] or empty).astype(bool),
+                        offsets)
+            self._schedules[n] = schedule
+        return schedule
+
+    def shuffle_vectorized(self, array: List) -> List:
+        """Same permutation as shuffle(), applied one switch layer at a time"""
+        idx1, idx2, swap, offsets = self.switch_schedule(len(array))
+        result = np.array(array)
+
+        integer = result.dtype.kind in 'iu'
+        if integer:
+            # All-ones where the switch is set, else 0
+            mask = -swap.astype(result.dtype)
+
+        for lo, hi in zip(offsets, offsets[1:]):
+            i1 = idx1[lo:hi]
+            i2 = idx2[lo:hi]
+            a = result[i1]
+            b = result[i2]
+            if integer:
+                # Branchless XOR swap: t is a ^ b where the switch is set, else 0
+                t = (a ^ b) & mask[lo:hi]
+                result[i1] = a ^ t
+                result[i2] = b ^ t
+            else:
+                result[i1] = np.where(swap[lo:hi], b, a)
+                result[i2] = np.where(swap[lo:hi], a, b)
+
+        return result.tolist()
+
+    def swap_elements(self, array: List, idx1: int, idx2: int, swap: int):
+        """Swap elements if swap=1"""
+        if swap:
+            array[idx1], array[idx2] = array[idx2], array[idx1]
+
+    def _reset_history(self, n: int):
+        """Preallocate switch history for an n-element shuffle"""
+        max_switches = n * math.ceil(math.log2(max(n, 2))) + n
+        self._hist_idx = np.empty((max_switches, 2), dtype=np.int64)
+        self._hist_swap = np.empty(max_switches, dtype=np.uint8)
+        self._hist_kind = np.empty(max_switches, dtype=np.uint8)
+        self._hist_num = np.empty(max_switches, dtype=np.int64)
+        self._hist_count = 0
+
+    def _grow_history(self):
+        """Double the history capacity, keeping the switches recorded so far"""
+        capacity = max(2 * len(self._hist_swap), 16)
+        k = self._hist_count
+        for name in ('_hist_idx', '_hist_swap', '_hist_kind', '_hist_num'):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:k] = old[:k]
+            setattr(self, name, new)
+
+    def _record_switch(self, idx1: int, idx2: int, swap: int, kind: int, num: int):
+        """Append one switch to the preallocated history
+
+        The history grows when full, so direct waksman_iterative calls (which
+        do not go through shuffle()'s reset) keep recording as well.
+        """
+        k = self._hist_count
+        if k == len(self._hist_swap):
+            self._grow_history()
+        self._hist_idx[k, 0] = idx1
+        self._hist_idx[k, 1] = idx2
+        self._hist_swap[k] = swap
+        self._hist_kind[k] = kind
+        self._hist_num[k] = num
+        self._hist_count = k + 1
+
+    @property
+    def switch_history(self) -> List[Tuple[int, int, int, str]]:
+        """Switches applied by the last shuffle as (idx1, idx2, swap, desc)"""
+        history = []
+        for k in range(self._hist_count):
+            kind = self._hist_kind[k]
+            num = int(self._hist_num[k])
+            if kind == SWITCH_BASE:
+                desc = "n=2 base"
+            elif kind == SWITCH_INPUT:
+                desc = f"input {num}"
+            else:
+                desc = f"output {num}"
+            history.append((int(self._hist_idx[k, 0]), int(self._hist_idx[k, 1]),
+                            int(self._hist_swap[k]), desc))
+        return history